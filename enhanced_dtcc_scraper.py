@@ -5,11 +5,37 @@ from datetime import datetime, timedelta
 import os
 from supabase import create_client, Client
 import re
+from functools import lru_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S.%fZ','%Y-%m-%dT%H:%M:%SZ','%Y-%m-%d %H:%M:%S')
+DATE_FORMATS = ('%Y-%m-%d','%d/%m/%Y','%m/%d/%Y')
+# Patterns used to pull API endpoints out of the dashboard page
+ENDPOINT_PATTERNS = (
+    re.compile(r'fetch\("([^"]*/api/[^"]*)"'),
+    re.compile(r'"(/ppd/api/[^"]*)"')
+)
+
+def _reformat(s, formats, out_fmt):
+    # Non-string values (e.g. a list from the feed) would be unhashable for
+    # the cache; they can never match a format, so fall back straight away
+    if not isinstance(s, str):
+        return None
+    return _cached_reformat(s, formats, out_fmt)
+
+@lru_cache(maxsize=4096)
+def _cached_reformat(s, formats, out_fmt):
+    # Many trades in a batch share timestamps/maturities, so memoise the
+    # strptime attempts. Failures return None and the caller picks a fallback.
+    for fmt in formats:
+        try:
+            return datetime.strptime(s, fmt).strftime(out_fmt)
+        except ValueError: pass
+    return None
+
 class DTCCCDSScraper:
     def __init__(self):
         # Supabase connection
@@ -29,28 +55,44 @@ class DTCCCDSScraper:
         self.session = requests.Session()
         self.session.headers.update(self.headers)
 
+        # ETag/Last-Modified per URL so unchanged responses come back as 304
+        self.validators = {}
+        self.cached_endpoints = None
+
+    def _conditional_headers(self, url):
+        etag, last_modified = self.validators.get(url, (None, None))
+        headers = {}
+        if etag: headers['If-None-Match'] = etag
+        if last_modified: headers['If-Modified-Since'] = last_modified
+        return headers
+
     def discover_api_endpoints(self):
         try:
-            r = self.session.get(self.ppd_dashboard, timeout=30)
+            r = self.session.get(self.ppd_dashboard, headers=self._conditional_headers(self.ppd_dashboard), timeout=30)
+            if r.status_code == 304 and self.cached_endpoints:
+                logger.info("Dashboard unchanged, reusing endpoints")
+                return self.cached_endpoints
             content = r.text
-            patterns = [
-                r'fetch\("([^"]*/api/[^"]*)"',
-                r'"(/ppd/api/[^"]*)"'
-            ]
             endpoints = set()
-            for p in patterns:
-                for match in re.findall(p, content):
+            for p in ENDPOINT_PATTERNS:
+                for match in p.findall(content):
                     if match.startswith("/"):
                         endpoints.add(self.dtcc_base + match)
                     else:
                         endpoints.add(match)
             logger.info(f"Discovered endpoints: {endpoints}")
+            if endpoints:
+                self.validators[self.ppd_dashboard] = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
+                self.cached_endpoints = list(endpoints)
             return list(endpoints)
         except Exception as e:
             logger.error(f"Endpoint discovery failed: {e}")
             return [f"{self.dtcc_base}/ppd/api/cds/trades"]
 
     def fetch_cds_trades(self, endpoint):
+        # Returns (trades, validators), or (None, None) when the endpoint
+        # answers 304. The caller remembers the validators only once the
+        # trades are stored, so a failed write is re-fetched
         params = {
             'product': 'CDS',
             'region': 'EU',
@@ -59,34 +101,28 @@ class DTCCCDSScraper:
             'sortOrder': 'desc'
         }
         try:
-            r = self.session.get(endpoint, params=params, timeout=30)
+            r = self.session.get(endpoint, params=params, headers=self._conditional_headers(endpoint), timeout=30)
+            if r.status_code == 304:
+                logger.info(f"No changes at {endpoint}")
+                return None, None
             r.raise_for_status()
             data = r.json()
+            validators = (r.headers.get('ETag'), r.headers.get('Last-Modified'))
             # Attempts to extract list from known keys
             for key in ['data','trades','records','results']:
                 if key in data and isinstance(data[key], list):
-                    return data[key]
+                    return data[key], validators
             if isinstance(data, list):
-                return data
+                return data, validators
         except Exception as e:
             logger.error(f"Fetch failed: {e}")
-        return []
+        return [], None
 
     def parse_timestamp(self, s):
-        for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ','%Y-%m-%dT%H:%M:%SZ','%Y-%m-%d %H:%M:%S'):
-            try:
-                dt = datetime.strptime(s, fmt)
-                return dt.strftime('%H:%M:%S')
-            except: pass
-        return datetime.now().strftime('%H:%M:%S')
+        return _reformat(s, TIMESTAMP_FORMATS, '%H:%M:%S') or datetime.now().strftime('%H:%M:%S')
 
     def parse_date(self, s):
-        for fmt in ('%Y-%m-%d','%d/%m/%Y','%m/%d/%Y'):
-            try:
-                dt = datetime.strptime(s, fmt)
-                return dt.strftime('%Y-%m-%d')
-            except: pass
-        return datetime.now().strftime('%Y-%m-%d')
+        return _reformat(s, DATE_FORMATS, '%Y-%m-%d') or datetime.now().strftime('%Y-%m-%d')
 
     def parse_trade(self, t):
         try:
@@ -108,19 +144,31 @@ class DTCCCDSScraper:
         except:
             return None
 
+    def store_trades(self, trades):
+        # The feed is capped at 1000 rows, so one request already sits in the
+        # batch sweet spot; skip echoing the rows back in the response
+        self.supabase.table('cds_prices').upsert(trades, returning='minimal').execute()
+
     def scrape_cycle(self):
         logger.info(f"[{datetime.now()}] Starting scrape")
         endpoints = self.discover_api_endpoints()
         all_trades = []
+        source, validators = None, None
         for ep in endpoints[:2]:
-            data = self.fetch_cds_trades(ep)
+            data, validators = self.fetch_cds_trades(ep)
+            if data is None:
+                # Unchanged since the last stored batch; not a reason to fall back
+                break
             if data:
+                source = ep
                 for raw in data:
                     parsed = self.parse_trade(raw)
                     if parsed: all_trades.append(parsed)
                 break
         if all_trades:
-            result = self.supabase.table('cds_prices').upsert(all_trades).execute()
+            self.store_trades(all_trades)
+            if any(validators):
+                self.validators[source] = validators
             logger.info(f"Stored {len(all_trades)} trades")
         else:
             logger.info("No new trades")